@@ -4,7 +4,7 @@
 """ © Ihor Mirzov, 2019-2022
 Distributed under GNU General Public License v3.0
 
-CalculiX to Paraview converter (frd to vtk/vtu).
+CalculiX to Paraview converter (frd to vtk/vtu/vtkhdf).
 Makes possible to view and postprocess CalculiX
 analysis results in Paraview. Generates Mises and
 Principal components for stress and strain tensors.
@@ -16,7 +16,7 @@ import logging
 import os
 
 # local import
-from .common import Converter
+from .common import Converter, DERIVED_RESULTS
 
 def clean_screen():
     """Clean screen."""
@@ -32,6 +32,27 @@ def filename_type(filename):
     return filename
 
 
+def add_compressor_argument(ap):
+    """Option to choose .vtu compressor."""
+    ap.add_argument('-c', '--compressor', default='zlib', choices=['zlib', 'lz4', 'none'],
+                    help='Compressor of .vtu files: lz4 is faster, none is fastest. ' \
+                        '.vtkhdf files are compressed with zlib or none')
+
+
+def add_fp32_argument(ap):
+    """Option to write results in single precision."""
+    ap.add_argument('--fp32', action='store_true',
+                    help='Write results as Float32: half the size of result arrays')
+
+
+def add_derived_argument(ap):
+    """Option to choose results calculated for stress and strain."""
+    ap.add_argument('-d', '--derived', nargs='*', default=list(DERIVED_RESULTS),
+                    choices=DERIVED_RESULTS,
+                    help='Results calculated for stress and strain tensors, ' \
+                        'none if the option is given without values')
+
+
 def main():
     """Create and run a converter."""
     # Configure logging
@@ -40,11 +61,16 @@ def main():
     # Command line arguments
     ap = argparse.ArgumentParser()
     ap.add_argument('filename', type=filename_type, help='FRD file name with extension')
-    ap.add_argument('format', type=str, nargs='+', help='Output format', choices=['vtk', 'vtu'])
+    ap.add_argument('format', type=str, nargs='+', help='Output format',
+                    choices=['vtk', 'vtu', 'vtkhdf'])
+    add_compressor_argument(ap)
+    add_derived_argument(ap)
+    add_fp32_argument(ap)
     args = ap.parse_args()
 
     # Create converter and run it
-    ccx2paraview = Converter(args.filename, args.format)
+    ccx2paraview = Converter(args.filename, args.format, compressor=args.compressor,
+                             derived=args.derived, fp32_results=args.fp32)
     ccx2paraview.run()
 
 
@@ -56,10 +82,14 @@ def main_with_format(output_format):
     # Command line arguments
     ap = argparse.ArgumentParser()
     ap.add_argument('filename', type=filename_type, help='FRD file name with extension')
+    add_compressor_argument(ap)
+    add_derived_argument(ap)
+    add_fp32_argument(ap)
     args = ap.parse_args()
 
     # Create converter and run it
-    ccx2paraview = Converter(args.filename, [output_format])
+    ccx2paraview = Converter(args.filename, [output_format], compressor=args.compressor,
+                             derived=args.derived, fp32_results=args.fp32)
     ccx2paraview.run()
 
 
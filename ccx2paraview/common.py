@@ -3,7 +3,7 @@
 """ © Ihor Mirzov, 2019-2022
 Distributed under GNU General Public License v3.0
 
-CalculiX to Paraview converter (frd to vtk/vtu).
+CalculiX to Paraview converter (frd to vtk/vtu/vtkhdf).
 Makes possible to view and postprocess CalculiX
 analysis results in Paraview. Generates Mises and
 Principal components for stress and strain tensors.
@@ -12,37 +12,140 @@ Principal components for stress and strain tensors.
 # Standard imports
 import os
 import logging
-import threading
-import math
-import re
+import concurrent.futures
+import mmap
+from xml.etree import ElementTree
+from itertools import compress
 
 # External imports
 import numpy as np
 try:
     # pylint: disable-next=no-name-in-module
     from vtk import (vtkUnstructuredGridWriter, vtkXMLUnstructuredGridWriter, \
-                    vtkPoints, vtkCellArray, vtkUnstructuredGrid, vtkDoubleArray)
+                    vtkPoints, vtkCellArray, vtkUnstructuredGrid, VTK_TYPE_INT32, VTK_TYPE_INT64)
+    from vtk import vtkStreamingDemandDrivenPipeline
+    from vtk.util.numpy_support import numpy_to_vtk, numpy_to_vtkIdTypeArray
+    from vtk.util.vtkAlgorithm import VTKPythonAlgorithmBase
 except ImportError as e:
     # pylint: disable-next=line-too-long
     raise ImportError("Module vtk is not available! Install either vtk or paraview before using ccx2paraview.") from e
-
-renumbered_nodes = {} # old_number : new_number
-
-def write_converted_file(file_name, ugrid):
+try:
+    # pylint: disable-next=no-name-in-module
+    from vtk import vtkHDFWriter # VTK >= 9.4
+except ImportError:
+    vtkHDFWriter = None # pylint: disable=invalid-name
+
+TILE_SIZE = 100000 # nodes in one batch of eigenvalue problems
+DEGENERATE_TOL = 1e-6 # closeness of eigenvalues solved with LAPACK instead of closed form
+LUT_DENSITY = 8 # nodes are renumbered by lookup table while max number < 8 * amount of nodes
+# Exact powers of ten, see decode_exponent_fields()
+POW10 = np.array([float(10**i) for i in range(23)])
+
+# Results calculated for stress and strain tensors by default
+DERIVED_RESULTS = ('mises', 'principal')
+
+# Result block names from .inp-file: frd_name : inp_name
+INP_NAMES = {
+    'DISP':'U',
+    'NDTEMP':'NT',
+    'STRESS':'S',
+    'TOSTRAIN':'E',
+    'FORC':'RF',
+    'PE':'PEEQ',
+    }
+
+# Amount of nodes in element of CalculiX type, types are 1-based
+NODES_PER_ELEMENT = np.array((0, 8, 6, 4, 20, 15, 10, 3, 6, 4, 8, 2, 3))
+# Positions of CalculiX element nodes in VTK cell, see get_element_connectivity()
+VTK_NODE_ORDER = {
+    4:tuple(range(12)) + tuple(range(16, 20)) + tuple(range(12, 16)), # 20 node brick
+    5:(0, 2, 1, 3, 5, 4), # 15 node penta as 6 node wedge
+    2:(0, 2, 1, 3, 5, 4), # 6 node wedge
+    }
+# Amount of nodes in VTK cell of CalculiX type
+NODES_PER_CELL = np.array([len(VTK_NODE_ORDER.get(t, range(n))) \
+    for t, n in enumerate(NODES_PER_ELEMENT)])
+
+def write_converted_file(file_name, ugrid, compressor='zlib'):
     """Writes .vtk and .vtu files based on data from FRD object.
     Uses native VTK Python package.
     Writes results for one time increment only.
     """
-    if file_name.endswith('vtk'):
+    write_file(create_writer(os.path.splitext(file_name)[1], ugrid, compressor), file_name)
+
+
+def create_writer(fmt, ugrid, compressor='zlib'):
+    """Configured .vtk or .vtu writer for the grid. It could be reused
+    for many files while the grid is changed between writes.
+    Compressor of .vtu data: 'zlib' (default), 'lz4' (faster) or 'none'.
+    """
+    if fmt == '.vtk':
         writer = vtkUnstructuredGridWriter()
         writer.SetInputData(ugrid)
-    elif file_name.endswith('vtu'):
+    elif fmt == '.vtu':
         writer = vtkXMLUnstructuredGridWriter()
         writer.SetInputDataObject(ugrid)
-        writer.SetDataModeToBinary() # compressed file
+        # Compressed data appended raw after XML: no base64 (+33% size)
+        writer.SetDataModeToAppended()
+        writer.EncodeAppendedDataOff()
+        writer.SetHeaderTypeToUInt64() # arrays over 4 GB when not compressed
+        if compressor == 'lz4':
+            writer.SetCompressorTypeToLZ4()
+        elif compressor == 'none':
+            writer.SetCompressorTypeToNone()
+        else:
+            writer.SetCompressorTypeToZLib()
+            writer.SetCompressionLevel(1) # twice faster than default 5, results compress poorly
+    return writer
+
+
+def write_file(writer, file_name):
+    """Write current state of the writer's grid to file."""
     writer.SetFileName(file_name)
     writer.Write()
 
+
+class IncrementSource(VTKPythonAlgorithmBase):
+    """Pipeline source of the mesh with results of one time increment.
+    vtkHDFWriter requests increments one by one: results are parsed
+    on demand, the mesh is the same for all of them and is written once.
+    """
+
+    def __init__(self, ugrid, times, get_data_arrays):
+        super().__init__(nInputPorts=0, nOutputPorts=1, outputType='vtkUnstructuredGrid')
+        self.ugrid = ugrid # mesh shared by all increments
+        self.times = np.asarray(times, dtype=float) # increasing time values
+        self.get_data_arrays = get_data_arrays # increment index -> [vtkDataArray, ]
+        self.index = None # of the last requested increment
+        self.data_arrays = [] # of the last requested increment
+
+    # pylint: disable-next=invalid-name,unused-argument
+    def RequestInformation(self, request, in_info, out_info):
+        """Announce time values of increments, none for a single one."""
+        if len(self.times) > 1:
+            info = out_info.GetInformationObject(0)
+            info.Set(vtkStreamingDemandDrivenPipeline.TIME_STEPS(), self.times, len(self.times))
+            info.Set(vtkStreamingDemandDrivenPipeline.TIME_RANGE(), self.times[[0, -1]], 2)
+        return 1
+
+    # pylint: disable-next=invalid-name,unused-argument
+    def RequestData(self, request, in_info, out_info):
+        """Mesh with results of the requested increment."""
+        info = out_info.GetInformationObject(0)
+        i = 0
+        if info.Has(vtkStreamingDemandDrivenPipeline.UPDATE_TIME_STEP()):
+            time = info.Get(vtkStreamingDemandDrivenPipeline.UPDATE_TIME_STEP())
+            i = int(np.abs(self.times - time).argmin())
+        ugrid = vtkUnstructuredGrid.GetData(out_info)
+        ugrid.ShallowCopy(self.ugrid)
+        pd = ugrid.GetPointData()
+        pd.Initialize() # results of this increment only
+        if i != self.index: # each increment is parsed once, even if requested again
+            self.index, self.data_arrays = i, self.get_data_arrays(i)
+        for da in self.data_arrays:
+            pd.AddArray(da)
+        return 1
+
 #
 # Classes and functions for reading CalculiX .frd files.
 
@@ -53,35 +156,58 @@ class NodalPointCoordinateBlock:
     """
 
     def __init__(self, in_file):
-        """Read nodal coordinates."""
-        renumbered_nodes.clear()
+        """Read nodal coordinates.
+        -1         1 0.00000E+00 0.00000E+00 0.00000E+00
+        """
         self.points = vtkPoints()
 
-        new_node_number = 0
-        while True:
-            line = in_file.readline().strip()
-
-            # End of block
-            if not line or line == '-3':
-                break
-
-            regex = '^-1(.{10})' + '(.{12})'*3
-            match = match_line(regex, line)
-            node_number = int(match.group(1))
-            node_coords = [ float(match.group(2)),
-                            float(match.group(3)),
-                            float(match.group(4)), ]
-
-            renumbered_nodes[node_number] = new_node_number
-            self.points.InsertPoint(new_node_number, node_coords)
-            new_node_number += 1
+        # Whole block is parsed at once by fixed-width columns
+        table = read_block_table(in_file, 49)
+        node_numbers = fixed_width_fields(table, 3, 10, 1).ravel().astype(np.int64)
+        # (N, 3) array: no objects per node. vtkPoints are float by default
+        self.coords, _ = parse_floats(fixed_width_fields(table, 13, 12, 3), np.float32)
+
+        self.node_numbers = node_numbers # in points order
+        # Usually nodes are written in ascending order: nothing to sort for binary search
+        ascending = bool((node_numbers[1:] > node_numbers[:-1]).all())
+        max_number = node_numbers.max(initial=-1)
+        if max_number < LUT_DENSITY * len(node_numbers) + 1024:
+            # Lookup table: renumbered_nodes[old_number] = new_number, -1 for absent nodes
+            # Half the memory of int64 and gathers hit cache more often
+            lut_type = np.int32 if len(node_numbers) < np.iinfo(np.int32).max else np.int64
+            self.renumbered_nodes = np.full(max_number + 1, -1, dtype=lut_type)
+            self.renumbered_nodes[node_numbers] = np.arange(len(node_numbers))
+            self.order = None
+        else:
+            # Sparse numbering: binary search in sorted node numbers
+            self.renumbered_nodes = None
+            self.order = np.arange(len(node_numbers)) if ascending \
+                else np.argsort(node_numbers, kind='stable')
+        self.points.SetData(numpy_to_vtk(self.coords)) # no copy is made
 
         self.numnod = self.points.GetNumberOfPoints() # number of nodes in this block
         logging.info('%d nodes', self.numnod) # total number of nodes
 
     def get_node_numbers(self):
-        """get node numbers."""
-        return sorted(renumbered_nodes.keys())
+        """get sorted node numbers.
+        NOTE Not used: results are rows in the node block order. Kept for API compatibility.
+        """
+        return np.unique(self.node_numbers)
+
+    def renumber(self, node_numbers):
+        """Array of new node numbers in one gather, -1 for absent nodes."""
+        new_numbers = np.full(len(node_numbers), -1, dtype=np.int64)
+        if self.order is None:
+            known = node_numbers < len(self.renumbered_nodes)
+            new_numbers[known] = self.renumbered_nodes[node_numbers[known]]
+        else:
+            sorted_numbers = self.node_numbers[self.order]
+            # Last one of the duplicated numbers - as in the lookup table
+            i = np.searchsorted(sorted_numbers, node_numbers, side='right') - 1
+            known = i >= 0
+            known[known] = sorted_numbers[i[known]] == node_numbers[known]
+            new_numbers[known] = self.order[i[known]]
+        return new_numbers
 
 
 # NOTE Not used
@@ -110,6 +236,71 @@ class NodalPointCoordinateBlock:
 #         return list(self.nodes.index.values)
 
 
+# VTK element type by CalculiX one, see convert_elem_type()
+# frd_elem_type : vtk_elem_type, index is the frd type number
+FRD2VTK_NUM = np.array((0, 12, 13, 10, 25, 13, 24, 5, 22, 9, 23, 3, 21), dtype=np.uint8)
+FRD2VTK_TXT = {
+    'C3D8':12,
+    'F3D8':12,
+    'C3D8R':12,
+    'C3D8I':12,
+    'C3D6':13,
+    'F3D6':13,
+    'C3D4':10,
+    'F3D4':10,
+    'C3D20':25,
+    'C3D20R':25,
+    'C3D15':13,
+    'C3D10':24,
+    'C3D10T':24,
+    'S3':5,
+    'M3D3':5,
+    'CPS3':5,
+    'CPE3':5,
+    'CAX3':5,
+    'S6':22,
+    'M3D6':22,
+    'CPS6':22,
+    'CPE6':22,
+    'CAX6':22,
+    'S4':9,
+    'S4R':9,
+    'M3D4':9,
+    'M3D4R':9,
+    'CPS4':9,
+    'CPS4R':9,
+    'CPE4':9,
+    'CPE4R':9,
+    'CAX4':9,
+    'CAX4R':9,
+    'S8':23,
+    'S8R':23,
+    'M3D8':23,
+    'M3D8R':23,
+    'CPS8':23,
+    'CPS8R':23,
+    'CPE8':23,
+    'CPE8R':23,
+    'CAX8':23,
+    'CAX8R':23,
+    'B21':3,
+    'B31':3,
+    'B31R':3,
+    'T2D2':3,
+    'T3D2':3,
+    'GAPUNI':3,
+    'DASHPOTA':3,
+    'SPRING2':3,
+    'SPRINGA':3,
+    'B32':21,
+    'B32R':21,
+    'T3D3':21,
+    'D':21,
+    'SPRING1':1,
+    'DCOUP3D':1,
+    'MASS':1}
+
+
 def convert_elem_type(frd_elem_type):
     """Convert Calculix element type to VTK.
     Keep in mind that CalculiX expands shell elements.
@@ -207,118 +398,27 @@ def convert_elem_type(frd_elem_type):
     |    | MASS     |               |      |                          |
     |____|__________|_______________|______|__________________________|
     """
-    # frd_elem_type : vtk_elem_type
-    frd2vtk_num = {
-        1: 12,
-        2: 13,
-        3: 10,
-        4: 25,
-        5: 13,
-        6: 24,
-        7:  5,
-        8: 22,
-        9:  9,
-        10: 23,
-        11:  3,
-        12: 21}
-    frd2vtk_txt = {
-        'C3D8':12,
-        'F3D8':12,
-        'C3D8R':12,
-        'C3D8I':12,
-        'C3D6':13,
-        'F3D6':13,
-        'C3D4':10,
-        'F3D4':10,
-        'C3D20':25,
-        'C3D20R':25,
-        'C3D15':13,
-        'C3D10':24,
-        'C3D10T':24,
-        'S3':5,
-        'M3D3':5,
-        'CPS3':5,
-        'CPE3':5,
-        'CAX3':5,
-        'S6':22,
-        'M3D6':22,
-        'CPS6':22,
-        'CPE6':22,
-        'CAX6':22,
-        'S4':9,
-        'S4R':9,
-        'M3D4':9,
-        'M3D4R':9,
-        'CPS4':9,
-        'CPS4R':9,
-        'CPE4':9,
-        'CPE4R':9,
-        'CAX4':9,
-        'CAX4R':9,
-        'S8':23,
-        'S8R':23,
-        'M3D8':23,
-        'M3D8R':23,
-        'CPS8':23,
-        'CPS8R':23,
-        'CPE8':23,
-        'CPE8R':23,
-        'CAX8':23,
-        'CAX8R':23,
-        'B21':3,
-        'B31':3,
-        'B31R':3,
-        'T2D2':3,
-        'T3D2':3,
-        'GAPUNI':3,
-        'DASHPOTA':3,
-        'SPRING2':3,
-        'SPRINGA':3,
-        'B32':21,
-        'B32R':21,
-        'T3D3':21,
-        'D':21,
-        'SPRING1':1,
-        'DCOUP3D':1,
-        'MASS':1}
-    if frd_elem_type in frd2vtk_num:
-        return frd2vtk_num[frd_elem_type]
-    if frd_elem_type in frd2vtk_txt:
-        return frd2vtk_txt[frd_elem_type]
+    if isinstance(frd_elem_type, str):
+        return FRD2VTK_TXT.get(frd_elem_type, 0)
+    if 0 <= frd_elem_type < len(FRD2VTK_NUM):
+        return int(FRD2VTK_NUM[frd_elem_type])
     return 0
 
 
 def get_element_connectivity(e_type, e_nodes):
     """Element connectivity with renumbered nodes.
-    Here passed element nodes are repositioned according to VTK rules.
+    Here passed (N, nodes per element) array of elements of the same type
+    is repositioned according to VTK rules with one gather.
+
+    frd: 20 node brick element - last eight nodes have to be repositioned.
+    frd: 15 node penta element - CalculiX elements type 5 are not supported
+    in VTK and has to be processed as CalculiX type 2 (6 node wedge,
+    VTK type 13). Additional nodes are omitted.
+    All other elements are not changed.
     """
-    connectivity = []
-
-    # frd: 20 node brick element
-    if e_type == 4:
-        # Last eight nodes have to be repositioned
-        r1 = tuple(range(12)) # 8,9,10,11
-        r2 = tuple(range(12, 16)) # 12,13,14,15
-        r3 = tuple(range(16, 20)) # 16,17,18,19
-        node_num_list = r1 + r3 + r2
-        for i in node_num_list:
-            connectivity.append(e_nodes[i]) # nodes after renumbering
-
-    # frd: 15 node penta element
-    elif e_type in (5,2):
-        # CalculiX elements type 5 are not supported in VTK and
-        # has to be processed as CalculiX type 2 (6 node wedge,
-        # VTK type 13). Additional nodes are omitted.
-        for i in [0,2,1,3,5,4]: # repositioning nodes
-            connectivity.append(e_nodes[i]) # nodes after renumbering
-
-    # All other elements
-    else:
-        n = len(e_nodes)
-        for i in range(n):
-            connectivity.append(e_nodes[i]) # nodes after renumbering
-
-    return connectivity
+    if e_type in VTK_NODE_ORDER:
+        return e_nodes[:, VTK_NODE_ORDER[e_type]]
+    return e_nodes
 
 
 class ElementDefinitionBlock:
@@ -326,24 +426,18 @@ class ElementDefinitionBlock:
     Generates vtkCellArray.
     """
 
-    def __init__(self, in_file):
+    def __init__(self, in_file, node_block):
         self.in_file = in_file
+        self.node_block = node_block
         self.cells = vtkCellArray()
-        self.types = []
+        self.types = np.empty(0, dtype=np.uint8) # VTK cell types
 
-        while True:
-            line = in_file.readline().strip()
-
-            # End of block
-            if not line or line == '-3':
-                break
-
-            self.read_element(line)
+        self.read_elements(read_block_lines(in_file))
 
         self.numelem = self.cells.GetNumberOfCells() # number of elements in this block
         logging.info('%d cells', self.numelem) # total number of elements
 
-    def read_element(self, line):
+    def read_elements(self, lines):
         """Read element composition
         -1         1    1    0AIR
         -2         1         2         3         4         5         6         7         8
@@ -354,30 +448,46 @@ class ElementDefinitionBlock:
         -1         3   12    0    2
         -2        10        12        11
         """
-        # element_num = int(line.split()[1])
-        element_type = int(line.split()[2])
-        element_nodes = []
-
-        for _ in range(self.num_lines(element_type)):
-            line = self.in_file.readline().strip()
-            nodes = [renumbered_nodes[int(n)] for n in line.split()[1:]]
-            element_nodes.extend(nodes)
-
-        # elem = Element(element_num, element_type, element_nodes)
-        # self.elements.append(elem)
-
-        vtk_elem_type = convert_elem_type(element_type)
-        self.types.append(vtk_elem_type)
-        # offset = amount_of_nodes_in_vtk_element(element_type, element_nodes)
-        connectivity = get_element_connectivity(element_type, element_nodes)
-        # c = vtkCell()
-        self.cells.InsertNextCell(len(connectivity), connectivity)
-
-    def num_lines(self, etype):
-        """Amount of lines in element connectivity definition.
-        First value is meaningless, since elements are 1-based.
-        """
-        return (0, 1, 1, 1, 2, 2, 1, 1, 1, 1, 1, 1, 1)[etype]
+        is_header = np.array(lines, dtype='S3') == b' -1'
+        headers = fixed_width_table(list(compress(lines, is_header)), 18)
+        element_types = fixed_width_fields(headers, 13, 5, 1).ravel().astype(np.int64)
+        unknown = (element_types < 1) | (element_types >= len(FRD2VTK_NUM)) # for lookup tables
+        if unknown.any():
+            raise KeyError(f'Unknown element type {element_types[unknown][0]}.')
+
+        # All node numbers of the block in one flat array, '-2' line markers dropped
+        nodes = np.fromstring(b' '.join(compress(lines, ~is_header)), dtype=np.int64, sep=' ')
+        nodes = self.node_block.renumber(nodes[nodes != -2])
+        if (nodes < 0).any():
+            raise KeyError('Elements refer to nodes absent in the node block.')
+        ends = np.cumsum(NODES_PER_ELEMENT[element_types]) # in the parsed nodes
+
+        # Connectivity of the same type elements is built at once
+        # and stored in place: no copy of the whole connectivity is kept
+        self.types = FRD2VTK_NUM[element_types]
+        offsets = np.zeros(len(element_types) + 1, dtype=np.int64)
+        np.cumsum(NODES_PER_CELL[element_types], out=offsets[1:])
+        # 32 bit cell storage for usual meshes: half the memory and smaller files
+        storage = np.int32 if offsets[-1] <= np.iinfo(np.int32).max else np.int64
+        offsets = offsets.astype(storage, copy=False)
+        connectivity = np.empty(offsets[-1], dtype=storage)
+        for element_type in np.unique(element_types).tolist():
+            indices = np.flatnonzero(element_types == element_type)
+            npe = NODES_PER_ELEMENT[element_type]
+            # Nodes are gathered right in VTK order, see get_element_connectivity()
+            order = np.array(VTK_NODE_ORDER.get(element_type, range(npe)))
+            e_nodes = nodes[(ends[indices] - npe)[:, np.newaxis] + order]
+            connectivity[offsets[indices][:, np.newaxis] + np.arange(len(order))] = e_nodes
+
+        # One call instead of InsertNextCell per element, arrays are not copied
+        try:
+            self.cells.SetData(numpy_to_vtk(offsets, array_type=VTK_TYPE_INT64 \
+                    if storage is np.int64 else VTK_TYPE_INT32),
+                numpy_to_vtk(connectivity, array_type=VTK_TYPE_INT64 \
+                    if storage is np.int64 else VTK_TYPE_INT32))
+        except TypeError: # older VTK accepts only vtkIdTypeArray
+            self.cells.SetData(numpy_to_vtkIdTypeArray(offsets.astype(np.int64)),
+                               numpy_to_vtkIdTypeArray(connectivity.astype(np.int64)))
 
 
 # NOTE Not used
@@ -422,16 +532,17 @@ class ElementDefinitionBlock:
 class NodalResultsBlock:
     """Nodal Results Block: cgx_2.20.pdf Manual, § 11.6."""
 
-    def __init__(self, line=''):
+    def __init__(self, line='', inc=0, step=0, encoding=None):
         """Read calculated values."""
         self.components = [] # component names
-        self.results = {} # dictionary with nodal result {node:data}
+        self.results = np.empty((0, 0)) # (numnod, ncomps) array in node block order
         self.name = None
-        self.inc = 0
+        self.inc = inc
         self.ncomps = 0
-        self.step = 0
+        self.step = step
         self.line = line
-        self.txt = ''
+        self.nonfinite = None # amount of NaN and Inf values, None if not counted
+        self.encoding = encoding # of dataset and component names, UTF-8 by default
         self.in_file = None
         self.node_block = None
 
@@ -439,7 +550,8 @@ class NodalResultsBlock:
         """Run the converter."""
         self.in_file = in_file
         self.node_block = node_block
-        self.inc, self.step = get_inc_step(self.line)
+        if not self.step: # not passed by the caller: parse the header line
+            self.inc, self.step = get_inc_step(self.line)
         self.read_vars_info()
         self.read_components_info()
         self.read_nodal_results()
@@ -451,26 +563,17 @@ class NodalResultsBlock:
         -4  STRESS      6    1
         -4  DOR1  Rx    4    1
         """
-        line = self.in_file.readline().strip()
-        regex = r'^-4\s+(\w+)' + r'\D+(\d+)'*2
-        match = match_line(regex, line)
-        self.ncomps = int(match.group(2)) # amount of components
-
-        # Rename result block to the name from .inp-file
-        inpname = {
-            'DISP':'U',
-            'NDTEMP':'NT',
-            'STRESS':'S',
-            'TOSTRAIN':'E',
-            'FORC':'RF',
-            'PE':'PEEQ',
-            }
-        self.name = match.group(1) # dataset name
+        line = self.in_file.readline()
+        self.name = get_fixed_name(line, b'-4', self.encoding) # dataset name
+        try:
+            self.ncomps = int(line[13:18]) # amount of components
+        except ValueError as e:
+            raise_syntax_error(line, e)
         # txt = 'Vars info: name {}, ncomps {}' \
         #     .format(self.name, self.ncomps)
         # logging.debug(txt)
-        if self.name in inpname:
-            self.name = inpname[self.name]
+        if self.name in INP_NAMES:
+            self.name = INP_NAMES[self.name] # rename to the name from .inp-file
 
     def read_components_info(self):
         """Iterate over components
@@ -496,12 +599,10 @@ class NodalResultsBlock:
         """
 
         for _ in range(self.ncomps):
-            line = self.in_file.readline()[5:]
-            regex = r'^\w+'
-            match = match_line(regex, line)
+            line = self.in_file.readline()
+            component_name = get_fixed_name(line, b'-5', self.encoding)
 
             # Exclude variable name from the component name: SXX->XX, EYZ->YZ
-            component_name = match.group(0)
             if component_name.startswith(self.name):
                 component_name = component_name[len(self.name):]
 
@@ -522,71 +623,58 @@ class NodalResultsBlock:
         -1         1 1.47281E+04 1.39140E+04 2.80480E+04 5.35318E+04 6.36642E+03 1.82617E+03
         -2           5.31719E+01 6.69780E+01 2.76244E+01 2.47686E+01 1.99930E+02 2.14517E+02
         """
-        # Fill data with zeroes - sometimes FRD result block has only non zero values
-        for node_num in self.node_block.get_node_numbers():
-            self.results[node_num] = [0]*self.ncomps
-
-        # Some warnings repeat too much time - mark them
-        before = ''
-        after = None
-        emitted_warning_types = {'NaNInf':0, 'WrongFormat':0}
-
-        results_counter = 0 # independent results counter
-        while True:
-            line = self.in_file.readline().strip()
-
-            # End of block
-            if not line or line == '-3':
-                break
-
-            row_comps = min(6, self.ncomps) # amount of values written in row
-            regex = r'^-1\s+(\d+)' + '(.{12})' * row_comps
-            match = match_line(regex, line)
-            node = int(match.group(1))
-            data = []
-            for c in range(row_comps):
-                m = match.group(c + 2)
-                try:
-                    # NaN/Inf values will be parsed
-                    num = float(m)
-                    if ('NaN' in m or 'Inf' in m):
-                        emitted_warning_types['NaNInf'] += 1
-                except ValueError:
-                    # Too big number is written without 'E'
-                    num = float(re.sub(r'(.+).([+-])(\d{3})', r'\1e\2\3', m))
-                    emitted_warning_types['WrongFormat'] += 1
-                    before = m
-                    after = num
-                data.append(num)
-
-            results_counter += 1
-            self.results[node] = data
-
-            # Result could be multiline
-            for j in range((self.ncomps-1)//6):
-                row_comps = min(6, self.ncomps-6*(j+1)) # amount of values written in row
-                line = self.in_file.readline().strip()
-                regex = r'^-2\s+' + '(.{12})' * row_comps
-                match = match_line(regex, line)
-                data = [float(match.group(c+1)) for c in range(row_comps)]
-                self.results[node].extend(data)
-
+        # Rows follow the order of points in the node block
+        numnod = self.node_block.numnod
+        if not self.ncomps:
+            read_block(self.in_file)
+            self.results = np.zeros((numnod, 0))
+            self.nonfinite = 0
+            return 0
+
+        # Result could be multiline: whole block is parsed at once by fixed-width columns
+        row_comps = min(6, self.ncomps) # amount of values written in row
+        lines_per_node = 1 + (self.ncomps - 1)//6
+        table = read_block_table(self.in_file, 13 + 12*row_comps, lines_per_node)
+        nodes = fixed_width_fields(table[::lines_per_node], 3, 10, 1).ravel().astype(np.int64)
+        fields = fixed_width_fields(table, 13, 12, row_comps) \
+            .reshape(len(nodes), lines_per_node*row_comps)[:, :self.ncomps]
+        data, wrong = parse_floats(fields)
+        results_counter = len(nodes) # independent results counter
+
+        if np.array_equal(nodes, self.node_block.node_numbers):
+            self.results = data # values for all nodes in their order: used as is
+        else:
+            rows = self.node_block.renumber(nodes)
+            # Fill data with zeroes - sometimes FRD result block has only non zero values
+            self.results = np.zeros((numnod, self.ncomps))
+            known = rows >= 0 # values for nodes, which are absent in the node block, are skipped
+            self.results[rows[known]] = data[known]
+            if not known.all():
+                logging.warning('Truncating %s data. More values than nodes.', self.name)
+
+        # Some warnings repeat too much time - count them once for the whole block
+        emitted_warning_types = {'NaNInf':0, 'WrongFormat':int(wrong.sum())}
+        emitted_warning_types['NaNInf'] = count_nonfinite(self.results)
+        self.nonfinite = emitted_warning_types['NaNInf'] # reused in convert_frd_data_to_vtk()
         if emitted_warning_types['NaNInf']:
             logging.warning('NaN and Inf are not supported in Paraview (%d warnings).', \
                             emitted_warning_types['NaNInf'])
         if emitted_warning_types['WrongFormat']:
+            before = fields[wrong][-1]
+            after = data[wrong][-1]
             logging.warning('Wrong format, %s -> %d (%d warnings).', \
-                            before.strip(), after, emitted_warning_types['WrongFormat'])
+                            before.strip().decode(errors='replace'), after,
+                            emitted_warning_types['WrongFormat'])
         return results_counter
 
-    def get_some_log(self):
-        """get line to log."""
-        if self.inc < 1:
-            time_str = f'time {self.inc:.2e}, '
-        else:
-            time_str = f'time {self.inc:.1f}, '
-        self.txt = f'Step {self.step}, ' + time_str  + f'{self.name}, ' \
-            + f'{len(self.components)} components, ' + f'{len(self.results)} values'
+    def log(self):
+        """Log summary of the block: info for non-empty one, warning otherwise.
+        The message is formatted by logging only if it is emitted.
+        """
+        time_fmt = '%.2e' if self.inc < 1 else '%.1f'
+        level = logging.INFO if len(self.results) else logging.WARNING
+        logging.log(level, 'Step %d, time ' + time_fmt + ', %s, %d components, %d values',
+                    self.step, self.inc, self.name, len(self.components), len(self.results))
 
 
 class FRD:
@@ -594,44 +682,48 @@ class FRD:
     To implement large file parsing we need a step-by-step reader and writer.
     """
 
-    def __init__(self, in_file):
+    def __init__(self, in_file, fp32_results=False, derived=DERIVED_RESULTS, encoding=None):
         """Read contents of the .frd file."""
-        self.in_file = in_file   # path to the .frd-file to be read
+        self.in_file = in_file   # .frd-file mapped to memory
         self.node_block = None  # node block
         self.elem_block = None  # elements block
         self.steps_increments = [] # [(step, inc), ]
+        self.increment_offsets = {} # {(step, inc): position of its first result block}
         self.ugrid = vtkUnstructuredGrid() # create empty grid in VTK
+        self.fp32_results = fp32_results # single precision results
+        self.derived = derived # calculated for stress and strain: ('mises', 'principal')
+        self.encoding = encoding # of result names, UTF-8 by default
 
     def parse_mesh(self):
         """Fill in self.ugrid."""
         while True:
+            pos = self.in_file.tell() # beginning of the line
             line = self.in_file.readline()
             if not line:
                 break
-            key = line[:5].strip()
 
             # Nodes
-            if key == '2':
+            if line.startswith(b'    2'):
                 self.node_block = NodalPointCoordinateBlock(self.in_file)
 
             # Elements
-            elif key == '3':
-                self.elem_block = ElementDefinitionBlock(self.in_file)
+            elif line.startswith(b'    3'):
+                self.elem_block = ElementDefinitionBlock(self.in_file, self.node_block)
 
             # Results
-            if key == '100':
-                self.in_file.seek(self.in_file.tell() - len(line)) # go up one line
+            elif line.startswith(b'  100'):
+                self.in_file.seek(pos) # go up one line
                 break
 
             # End
-            if key == '9999':
+            elif line.startswith(b' 9999'):
                 break
 
         if self.node_block.numnod:
             self.ugrid.SetPoints(self.node_block.points) # insert all points to the grid
         if self.elem_block.numelem:
-            self.ugrid.Allocate(self.elem_block.numelem)
-            self.ugrid.SetCells(self.elem_block.types, self.elem_block.cells)
+            # Cell arrays are replaced at once - nothing to allocate
+            self.ugrid.SetCells(numpy_to_vtk(self.elem_block.types), self.elem_block.cells)
 
     def count_increments(self):
         """Count amount of time increments and amount of calculated variables.
@@ -639,19 +731,19 @@ class FRD:
         each time increment.
         """
         init_pos = self.in_file.tell()
-        while True:
-            line = self.in_file.readline()
-            if not line:
-                break
-            key = line[:5].strip()
-            # Results
-            if key == '100':
-                inc, step = get_inc_step(line)
-                if (step, inc) not in self.steps_increments:
-                    self.steps_increments.append((step, inc))
-            # End
-            elif key == '9999':
-                break
+        end = self.in_file.find(b'\n 9999', max(init_pos - 1, 0))
+        if end < 0:
+            end = len(self.in_file)
+
+        # Jump from one result block header to another
+        pos = self.in_file.find(b'\n  100', max(init_pos - 1, 0), end)
+        while pos >= 0:
+            self.in_file.seek(pos + 1)
+            inc, step = get_inc_step(self.in_file.readline())
+            if (step, inc) not in self.increment_offsets:
+                self.increment_offsets[(step, inc)] = pos + 1
+                self.steps_increments.append((step, inc))
+            pos = self.in_file.find(b'\n  100', pos + 1, end)
         self.in_file.seek(init_pos)
 
         i = len(self.steps_increments)
@@ -665,39 +757,48 @@ class FRD:
         """Header: key == '1' or key == '1P'."""
         result_blocks = []
         if step:
+            # Jump to the increment: there could be other blocks in between
+            if (step, inc) in self.increment_offsets:
+                self.in_file.seek(self.increment_offsets[(step, inc)])
             while True:
+                pos = self.in_file.tell() # beginning of the line
                 line = self.in_file.readline()
                 if not line:
                     break
-                key = line[:5].strip()
 
                 # Read results for certain time increment
-                if key == '100':
+                if line.startswith(b'  100'):
                     # logging.debug('line: ' + line)
                     got_inc, got_step = get_inc_step(line)
                     if inc != got_inc or step != got_step:
-                        self.in_file.seek(self.in_file.tell() - len(line)) # go up one line
+                        self.in_file.seek(pos) # go up one line
                         break
 
-                    b = NodalResultsBlock(line)
+                    # Header is parsed once
+                    b = NodalResultsBlock(line, got_inc, got_step, self.encoding)
                     b.run(self.in_file, self.node_block)
                     result_blocks.append(b)
-                    b.get_some_log()
-                    if b.name in ('S', 'ZZSTR'):
-                        result_blocks.append(self.calculate_mises_stress(b))
-                        result_blocks.append(self.calculate_principal(b))
-                    if b.name in ('E', 'MESTRAIN'):
-                        result_blocks.append(self.calculate_mises_strain(b))
-                        result_blocks.append(self.calculate_principal(b))
+                    if b.name in ('S', 'ZZSTR', 'E', 'MESTRAIN'):
+                        if 'mises' in self.derived:
+                            result_blocks.append(self.calculate_mises(b))
+                        if 'principal' in self.derived:
+                            result_blocks.append(self.calculate_principal(b))
+                    if self.fp32_results: # derived results are calculated in double
+                        b.results = single_precision(b.results)
+                        b.nonfinite = None # too big values became Inf, count again
 
                 # End
-                elif key == '9999':
+                elif line.startswith(b' 9999'):
                     break
 
         return result_blocks
 
-    def calculate_mises_stress(self, b):
-        """Append von Mises stress."""
+    def calculate_mises(self, b):
+        """Append von Mises stress or equivalent strain.
+        The kernel is chosen once by the block name,
+        then applied to all nodes at once.
+        """
+        kernel = mises_stress if b.name in ('S', 'ZZSTR') else mises_strain
         b1 = NodalResultsBlock()
         b1.name = b.name + '_Mises'
         b1.components = (b1.name, )
@@ -705,59 +806,12 @@ class FRD:
         b1.inc = b.inc
         b1.step = b.step
 
-        # Iterate over nodes
-        for node_num in b.node_block.get_node_numbers():
-            data = b.results[node_num] # list with results for current node
-            s_xx = data[0]
-            s_yy = data[1]
-            s_zz = data[2]
-            s_xy = data[3]
-            s_yz = data[4]
-            s_xz = data[5]
-
-            # Calculate Mises stress for current node
-            mises = 1 / math.sqrt(2) \
-                * math.sqrt((s_xx - s_yy)**2 \
-                + (s_yy - s_zz)**2 \
-                + (s_zz - s_xx)**2 \
-                + 6 * s_yz**2 \
-                + 6 * s_xz**2 \
-                + 6 * s_xy**2)
-            b1.results[node_num] = [mises]
-
-        b1.get_some_log()
-        return b1
-
-    def calculate_mises_strain(self, b):
-        """Append von Mises equivalent strain."""
-        b1 = NodalResultsBlock()
-        b1.name = b.name + '_Mises'
-        b1.components = (b1.name,)
-        b1.ncomps = len(b1.components)
-        b1.inc = b.inc
-        b1.step = b.step
+        tensors = b.results[:, :6] # (N, 6) array
+        mises_values = kernel(tensors) # computed in double to avoid overflow
+        if self.fp32_results:
+            mises_values = single_precision(mises_values)
+        b1.results = mises_values[:, np.newaxis]
 
-        # Iterate over nodes
-        for node_num in b.node_block.get_node_numbers():
-            data = b.results[node_num] # list with results for current node
-            s_xx = data[0]
-            s_yy = data[1]
-            s_zz = data[2]
-            s_xy = data[3]
-            s_yz = data[4]
-            s_xz = data[5]
-
-            # Calculate Mises stress for current node
-            mises = 1 / math.sqrt(2) \
-                * math.sqrt((s_xx - s_yy)**2 \
-                + (s_yy - s_zz)**2 \
-                + (s_zz - s_xx)**2 \
-                + 6 * s_yz**2 \
-                + 6 * s_xz**2 \
-                + 6 * s_xy**2)
-            b1.results[node_num] = [mises]
-
-        b1.get_some_log()
         return b1
 
     def calculate_principal(self, b):
@@ -769,26 +823,12 @@ class FRD:
         b1.inc = b.inc
         b1.step = b.step
 
-        # Iterate over nodes
-        for node_num in b.node_block.get_node_numbers():
-            data = b.results[node_num] # list with results for current node
-            t_xx = data[0]
-            t_yy = data[1]
-            t_zz = data[2]
-            t_xy = data[3]
-            t_yz = data[4]
-            t_xz = data[5]
-            tensor = np.array([[t_xx, t_xy, t_xz], [t_xy, t_yy, t_yz], [t_xz, t_yz, t_zz]])
-
-            # Calculate principal values for current node
-            eigenvalues = sorted(np.linalg.eigvals(tensor).tolist())
-            if math.fabs(eigenvalues[0]) > math.fabs(eigenvalues[-1]):
-                eigenvalues.append(eigenvalues[0])
-            else:
-                eigenvalues.append(eigenvalues[-1])
-            b1.results[node_num] = eigenvalues
+        tensors = b.results[:, :6] # (N, 6) array
+        eigenvalues = principal_values(tensors)
+        if self.fp32_results:
+            eigenvalues = single_precision(eigenvalues)
+        b1.results = eigenvalues
 
-        b1.get_some_log()
         return b1
 
     def has_mesh(self):
@@ -800,98 +840,380 @@ class FRD:
         return False
 
 
+def single_precision(values):
+    """Float32 copy of the values: half the size in files.
+    FRD values have 6 significant digits, too big ones become Inf.
+    """
+    with np.errstate(over='ignore'):
+        return values.astype(np.float32)
+
+
+def mises_stress(t):
+    """Von Mises stress for (N, 6) array of tensor components
+    xx, yy, zz, xy, yz, xz. Returns (N,) array.
+    """
+    s_xx, s_yy, s_zz, s_xy, s_yz, s_xz = t.T
+    # 1/sqrt(2) * sqrt(...) with the coefficient moved under the root.
+    # Sums are accumulated in place: two (N,) temporaries instead of a dozen
+    normal = np.square(s_xx - s_yy)
+    normal += np.square(s_yy - s_zz)
+    normal += np.square(s_zz - s_xx)
+    normal *= 0.5
+    shear = np.square(s_yz)
+    shear += np.square(s_xz)
+    shear += np.square(s_xy)
+    shear *= 3
+    normal += shear
+    return np.sqrt(normal, out=normal)
+
+
+def mises_strain(t):
+    """Von Mises equivalent strain for (N, 6) array of tensor components.
+    Uses the same expression as mises_stress().
+    """
+    return mises_stress(t)
+
+
+def principal_values(t):
+    """Eigenvalues for (N, 6) array of symmetric tensor components
+    xx, yy, zz, xy, yz, xz. Tensors are solved by tiles of TILE_SIZE,
+    so temporary arrays stay small.
+    Returns (N, 4) array: Min, Mid, Max and Worst - the one
+    with the biggest absolute value.
+    """
+    result = np.empty((len(t), 4))
+    for start in range(0, len(t), TILE_SIZE):
+        tile = t[start:start + TILE_SIZE]
+        result[start:start + len(tile), :3] = symmetric_eigenvalues(tile)
+
+    eigenvalues = result[:, :3]
+    result[:, 3] = np.where(np.fabs(eigenvalues[:, 0]) > np.fabs(eigenvalues[:, -1]),
+                            eigenvalues[:, 0], eigenvalues[:, -1])
+    return result
+
+
+def symmetric_eigenvalues(t):
+    """Closed-form (trigonometric) eigenvalues of symmetric 3x3 tensors
+    given as (N, 6) array xx, yy, zz, xy, yz, xz. No LAPACK calls.
+    Returns (N, 3) array sorted ascending.
+    """
+    t_xx, t_yy, t_zz, t_xy, t_yz, t_xz = t.T
+    # Squares and cubes of components above ~1e102 overflow: solved with LAPACK below
+    with np.errstate(over='ignore', divide='ignore', invalid='ignore'):
+        q = (t_xx + t_yy + t_zz) / 3 # mean of the eigenvalues
+        d_xx, d_yy, d_zz = t_xx - q, t_yy - q, t_zz - q # deviator
+        p = np.sqrt((d_xx**2 + d_yy**2 + d_zz**2 \
+            + 2 * (t_xy**2 + t_yz**2 + t_xz**2)) / 6)
+
+        # r = det(deviator / p) / 2, p == 0 for spherical tensor
+        det = d_xx * (d_yy*d_zz - t_yz**2) \
+            - t_xy * (t_xy*d_zz - t_yz*t_xz) \
+            + t_xz * (t_xy*t_yz - d_yy*t_xz)
+        p_cubed = p**3
+        r = np.where(p > 0, det / (2 * p_cubed), 0)
+        phi = np.arccos(np.clip(r, -1, 1)) / 3
+
+        eigenvalues = np.empty((len(t), 3))
+        eigenvalues[:, 2] = q + 2 * p * np.cos(phi) # max
+        eigenvalues[:, 0] = q + 2 * p * np.cos(phi + 2 * np.pi / 3) # min
+        eigenvalues[:, 1] = 3 * q - eigenvalues[:, 0] - eigenvalues[:, 2] # mid
+
+    # arccos is ill-conditioned near |r| == 1 (two close eigenvalues):
+    # such tensors are solved again with one batched LAPACK call,
+    # as well as finite tensors overflowed in the closed form
+    overflow = ~np.isfinite(r) | ~np.isfinite(p_cubed)
+    degenerate = ((np.fabs(r) > 1 - DEGENERATE_TOL) & (p > 0) | overflow) \
+        & np.isfinite(t).all(axis=1)
+    if degenerate.any():
+        eigenvalues[degenerate] = np.linalg.eigvalsh(symmetric_tensors(t[degenerate]))
+    return eigenvalues
+
+
+def symmetric_tensors(t):
+    """(N, 3, 3) array of symmetric tensors from (N, 6) array
+    of components xx, yy, zz, xy, yz, xz.
+    """
+    tensors = np.empty((len(t), 3, 3))
+    tensors[:, 0, 0], tensors[:, 1, 1], tensors[:, 2, 2] = t[:, 0], t[:, 1], t[:, 2]
+    tensors[:, 0, 1] = tensors[:, 1, 0] = t[:, 3]
+    tensors[:, 1, 2] = tensors[:, 2, 1] = t[:, 4]
+    tensors[:, 0, 2] = tensors[:, 2, 0] = t[:, 5]
+    return tensors
+
+
 def get_inc_step(line):
     """Read step information
     CL  101 0.36028E+01         320                     3    1           1
     CL  101 1.000000000         803                     0    1           1
     CL  101 1.000000000          32                     0    1           1
     CL  102 117547.9305          90                     2    2MODAL      1
+    Fixed columns: value E12 from 12, numnod I12, text A20, ictype I2, step I5.
     """
-    line = line[12:]
-    regex = r'^(.{12})\s+\d+\s+\d+\s+(\d+)'
-    match = match_line(regex, line)
-    inc = float(match.group(1)) # could be frequency, time or any numerical value
-    step = int(match.group(2)) # step number
+    try:
+        inc = float(line[12:24]) # could be frequency, time or any numerical value
+        step = int(line[58:63]) # step number
+    except ValueError as e:
+        logging.error("Can\'t parse step information:\n%s", line)
+        raise SyntaxError(f"Can\'t parse step information:\n{line}") from e
     # txt = 'Step info: value {}, step {}'.format(inc, step)
     # logging.debug(txt)
     return inc, step
 
 
-def match_line(regex, line):
-    """Search regex in line and report problems.
-    NOTE Using regular expressions is faster than splitting strings.
+def get_fixed_name(line, key, encoding=None):
+    """Get the first word of the name field A8 from key line:
+     -4  DISP        4    1
+     -4  DOR1  Rx    4    1
+     -5  D1          1    2    1    0
+    Columns are fixed: key I2 from 1, name from 5. No regex is needed.
+    Name is decoded with given encoding, UTF-8 by default,
+    undecodable bytes are replaced.
     """
-    match = re.search(regex, line)
-    if match:
-        return match
-    logging.error("Can\'t parse line:\n%s\nwith regex:\n%s", line, regex)
-    raise SyntaxError(f"Can\'t parse line:\n{line}\nwith regex:\n{regex}")
+    words = line[5:13].split()
+    if line[1:3] != key or not words:
+        raise_syntax_error(line)
+    return words[0].decode(encoding or 'utf-8', errors='replace')
+
+
+def raise_syntax_error(line, cause=None):
+    """Report a line which doesn't follow the FRD format."""
+    line = line.rstrip().decode(errors='replace')
+    logging.error("Can\'t parse line:\n%s", line)
+    raise SyntaxError(f"Can\'t parse line:\n{line}") from cause
 
 
+def read_block(in_file):
+    """Read bytes of the block up to its end: -3.
+    The end of block is searched in the mapped file,
+    so there is no Python code per line.
+    """
+    start = in_file.tell()
+    end = in_file.find(b'\n -3', start - 1) # block could end at once
+    if end < 0:
+        end = len(in_file) # no end of block till the end of file
+    data = in_file[start:end + 1]
+    in_file.seek(min(end + 1, len(in_file))) # beginning of the -3 line
+    in_file.readline()
+    return data
+
+
+def read_block_lines(in_file):
+    """Read all lines of the block up to its end: -3."""
+    return read_block(in_file).splitlines()
+
+
+def read_block_table(in_file, width, lines_per_record=1):
+    """Read the block up to its end as (L, width) array of bytes.
+    If all records (lines_per_record lines of one node) have the same
+    layout, the block bytes are viewed as a table without splitting
+    into lines. Shorter lines are padded with zeros.
+    """
+    data = read_block(in_file)
+    ends = [-1] # line ends in the first record
+    for _ in range(lines_per_record):
+        ends.append(data.find(b'\n', ends[-1] + 1))
+        if ends[-1] < 0:
+            break
+    length = ends[-1] + 1 # of the record with line ends
+    if length > 0 and len(data) % length == 0:
+        rows = np.frombuffer(data, dtype=np.uint8).reshape(-1, length)
+        if (rows[:, ends[1:]] == ord('\n')).all() \
+                and np.count_nonzero(rows == ord('\n')) == rows.shape[0] * lines_per_record:
+            table = np.zeros((rows.shape[0], lines_per_record, width), dtype=np.uint8)
+            for i, (start, end) in enumerate(zip(ends, ends[1:])):
+                start += 1
+                if end > start and rows[0, end - 1] == ord('\r'):
+                    end -= 1 # without line end
+                if lines_per_record == 1 and end - start >= width:
+                    return rows[:, :width] # no copy
+                chars = min(end - start, width)
+                table[:, i, :chars] = rows[:, start:start + chars]
+            return table.reshape(-1, width)
+    return fixed_width_table(data.splitlines(), width)
+
+
+def fixed_width_table(lines, width):
+    """Stack lines into (L, width) array of bytes.
+    Longer lines are cut, shorter ones are padded with zeros.
+    """
+    return np.array(lines, dtype=f'S{width}').view(np.uint8).reshape(len(lines), width)
+
+
+def fixed_width_fields(table, start, width, count):
+    """Slice count fields of given width from each row of the table.
+    Returns (L, count) array of bytes strings.
+    """
+    columns = table[:, start:start + width*count]
+    try:
+        return columns.view(f'S{width}') # no copy of the block text, numpy >= 1.23
+    except ValueError:
+        return np.ascontiguousarray(columns).view(f'S{width}')
+
+
+def parse_floats(fields, dtype=np.float64):
+    """Convert array of E12.5 fields to floats of given type.
+    Too big numbers are written without 'E': -1.00000+100.
+    Returns values and mask of such wrong format fields.
+    """
+    values, decoded = decode_exponent_fields(fields)
+    wrong = np.zeros(fields.shape, dtype=bool)
+    if not decoded.all(): # only the rest is converted from text
+        rest = ~decoded
+        values[rest], wrong[rest] = parse_float_strings(fields[rest])
+    return values.astype(dtype, copy=False), wrong
+
+
+def decode_exponent_fields(fields):
+    """Decode E12.5 fields ' 1.23456E-02' by byte columns, without text parsing.
+    Mantissa is an exact integer below 1e6, power of ten is exact
+    for exponents up to 22: one multiplication or division gives
+    the same correctly rounded double as strtod.
+    Returns values and mask of decoded fields, the rest are zeros.
+    """
+    # (12, F) array: each byte column of all fields is contiguous
+    cols = np.ascontiguousarray(fields.reshape(-1)).view(np.uint8).reshape(-1, 12).T
+    cols = np.ascontiguousarray(cols)
+    digits = cols - np.uint8(ord('0'))
+    negative = cols[0] == ord('-')
+    exp_negative = cols[9] == ord('-')
+    decoded = digits[[1, 3, 4, 5, 6, 7, 10, 11]].max(axis=0) <= 9
+    decoded &= (cols[2] == ord('.')) & (cols[8] == ord('E'))
+    decoded &= exp_negative | (cols[9] == ord('+'))
+    decoded &= negative | (cols[0] == ord(' '))
+
+    mantissa = digits[1] * np.int32(100000)
+    for col, weight in zip(range(3, 8), (10000, 1000, 100, 10, 1)):
+        mantissa += digits[col] * np.int32(weight)
+    exponent = digits[10] * np.int16(10) + digits[11]
+    np.negative(exponent, out=exponent, where=exp_negative)
+    exponent -= 5 # of the integer mantissa
+    decoded &= np.abs(exponent) < len(POW10)
+    exponent[~decoded] = 0
+
+    scale = POW10[np.abs(exponent)]
+    values = mantissa * scale
+    np.divide(mantissa, scale, out=values, where=exponent < 0)
+    np.negative(values, out=values, where=negative)
+    values[~decoded] = 0.0
+    return values.reshape(fields.shape), decoded.reshape(fields.shape)
+
+
+def parse_float_strings(fields):
+    """Convert array of E12.5 fields to doubles by numpy text parsing.
+    Returns values and mask of wrong format fields.
+    """
+    try:
+        return fields.astype(np.float64), np.zeros(fields.shape, dtype=bool)
+    except ValueError:
+        pass
+
+    # Insert 'e' before the sign of the three-digit exponent.
+    # Fields are checked by byte columns, not by string functions
+    chars = fields.astype('S12').view(np.uint8).reshape(fields.shape + (12,))
+    wrong = (chars != ord('E')).all(axis=-1) \
+        & ((chars[..., 8] == ord('+')) | (chars[..., 8] == ord('-')))
+    clean = fields.copy()
+    clean[wrong] = b'0'
+    values = clean.astype(np.float64)
+    # Only the few wrong fields are repaired
+    fixed = np.insert(chars[wrong], 8, ord('e'), axis=-1)
+    values[wrong] = np.ascontiguousarray(fixed).view('S13')[:, 0].astype(np.float64)
+    return values, wrong
 
 
 # Main class and functions.
 
 
-def convert_frd_data_to_vtk(b, node_block):
-    """Convert parsed FRD data to vtkDoubleArray."""
-    data_array = vtkDoubleArray()
-    data_array.SetName(b.name)
-    data_array.SetNumberOfComponents(len(b.components))
-    data_array.SetNumberOfTuples(node_block.numnod)
+def count_nonfinite(values):
+    """Amount of NaN and Inf values in the array.
+    Sum of all values is finite only if all of them are finite:
+    then no mask is built. Otherwise (or if the sum overflows)
+    the values are counted.
+    """
+    with np.errstate(over='ignore', invalid='ignore'):
+        if np.isfinite(values.sum()):
+            return 0
+    return int(values.size - np.count_nonzero(np.isfinite(values)))
 
-    # Set component names
-    for i,c in enumerate(b.components):
-        if 'SDV' in c:
-            data_array.SetComponentName(i, i)
-        else:
-            data_array.SetComponentName(i, c)
+
+def convert_frd_data_to_vtk(b):
+    """Convert (numnod, ncomps) array of results to vtkDataArray in one call.
+    Data type of the array (double or float) is preserved.
+    VTK array shares memory with the numpy one - no copy is made.
+    """
+    values = np.ascontiguousarray(b.results)
 
     # Some warnings repeat too much time - mark them
     emitted_warning_types = {'Inf':0, 'NaN':0}
+    # Parsed blocks are counted while reading, skip clean ones
+    nonfinite = count_nonfinite(values) if b.nonfinite is None else b.nonfinite
+    if nonfinite:
+        bad = ~np.isfinite(values)
+        emitted_warning_types['NaN'] = int(np.isnan(values[bad]).sum())
+        emitted_warning_types['Inf'] = nonfinite - emitted_warning_types['NaN']
+        np.copyto(values, 0.0, where=bad) # masked store, no index array
+    data_array = numpy_to_vtk(values) # keeps reference to values
+    data_array.SetName(b.name)
 
-    # Assign data
-    if len(b.results) > node_block.numnod:
-        txt = f'Truncating {b.name} data. More values than nodes.'
-        logging.warning(txt)
-
-    nodes = node_block.get_node_numbers()
-    for i,n in enumerate(nodes):
-        node_values = b.results[n]
-        for j,r in enumerate(node_values):
-            if math.isinf(r):
-                node_values[j] = 0.0
-                emitted_warning_types['Inf'] += 1
-            if math.isnan(r):
-                node_values[j] = 0.0
-                emitted_warning_types['NaN'] += 1
-        data_array.InsertTuple(i, node_values)
+    # Set component names, SDV components are named by their index
+    for i,c in enumerate(b.components):
+        data_array.SetComponentName(i, str(i) if 'SDV' in c else c)
 
     for k,v in emitted_warning_types.items():
         if v > 0:
-            logging.warning('%d %d values are converted to 0.0', v, k)
+            logging.warning('%d %s values are converted to 0.0', v, k)
 
     return data_array
 
 
 class Converter:
-    """Converts CalculiX .frd file to .vtk (ASCII) or .vtu (XML) format."""
+    """Converts CalculiX .frd file to .vtk (ASCII), .vtu (XML) or .vtkhdf (HDF5) format."""
 
     # TODO Merge with FRD class
 
-    def __init__(self, frd_file_name, fmt_list, encoding:str=None):
+    # pylint: disable-next=too-many-arguments
+    def __init__(self, frd_file_name, fmt_list, encoding:str=None, fp32_results:bool=False,
+                 compressor:str='zlib', derived=DERIVED_RESULTS):
         self.frd_file_name = frd_file_name
-        self.fmt_list = ['.' + fmt.lower() for fmt in fmt_list] # ['.vtk', '.vtu']
-        self.encoding = encoding
+        self.fmt_list = ['.' + fmt.lower() for fmt in fmt_list] # ['.vtk', '.vtu', '.vtkhdf']
+        # Fail before the expensive parsing of .frd-file
+        unsupported = set(self.fmt_list) - {'.vtk', '.vtu', '.vtkhdf'}
+        if unsupported or not self.fmt_list:
+            raise ValueError(f'Output formats should be vtk, vtu and/or vtkhdf, got {fmt_list}')
+        if '.vtkhdf' in self.fmt_list and vtkHDFWriter is None:
+            raise ValueError('Output to vtkhdf needs VTK 9.4 or newer')
+        self.encoding = encoding # of names in .frd-file and of .pvd-file
+        self.fp32_results = fp32_results # write results as Float32
+        self.compressor = compressor # .vtu compressor: 'zlib', 'lz4' or 'none'
+        unsupported = set(derived) - set(DERIVED_RESULTS)
+        if unsupported:
+            raise ValueError(f'Derived results should be mises and/or principal, got {derived}')
+        self.derived = tuple(derived) # skipped ones are not calculated at all
         self.frd = None
+        self.step_inc_nums = [] # [(step, inc, num), ] cached step_inc_num()
 
     def run(self):
         """Run the Converter."""
-        threads = [] # list of Threads
         logging.info('Reading %s', os.path.basename(self.frd_file_name))
-        in_file = open(self.frd_file_name, 'r', encoding = self.encoding)
-        self.frd = FRD(in_file)
-
+        if not os.path.getsize(self.frd_file_name):
+            logging.warning('File is empty!')
+            raise TypeError("No mesh found in .inp-file!")
+        # Binary mode: compare bytes, no decoding. The file is mapped to memory:
+        # OS reads pages on demand, blocks are searched without reading line by line
+        with open(self.frd_file_name, 'rb') as f:
+            in_file = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        with in_file: # closed on errors too: open mapping locks the file on Windows
+            if hasattr(mmap, 'MADV_SEQUENTIAL'): # not on Windows
+                # Blocks are read in order: aggressive readahead
+                in_file.madvise(mmap.MADV_SEQUENTIAL)
+            self.frd = FRD(in_file, self.fp32_results, self.derived, self.encoding)
+            try:
+                self.convert()
+            finally:
+                self.frd.in_file = None # the map is closed: nothing to parse any more
+
+    def convert(self):
+        """Parse mapped .frd-file and write files for all time increments."""
         # Check if file contains mesh data
         self.frd.parse_mesh()
         if not self.frd.has_mesh():
@@ -907,37 +1229,76 @@ class Converter:
         # ccx2paraview_3 - slight refactoring of 1     7m 25.4s    25m 1.1s
 
         self.frd.count_increments()
-        for step, inc, num in self.step_inc_num(): # NOTE Could be (0, 0, '')
-            result_blocks = self.frd.parse_results(step, inc) # NOTE Could be empty list []
-            for b in result_blocks:
-                if len(b.results):
-                    logging.info(b.txt)
-                else:
-                    logging.warning(b.txt)
-                if len(b.results) and len(b.components):
-                    pd = self.frd.ugrid.GetPointData()
-                    da = convert_frd_data_to_vtk(b, self.frd.node_block)
+        self.step_inc_nums = self.step_inc_num()
+        stem = self.frd_file_name[:-4] # output file name without extension
+        base_name = os.path.basename(stem) # split once for all log messages
+        # A file for each increment, .vtkhdf holds all of them
+        fmts = [fmt for fmt in self.fmt_list if fmt != '.vtkhdf']
+        # Files of two increments at most are written at the same time.
+        # The mesh is built once and shared by two grids used in turn,
+        # only their point data is changed between increments.
+        # Still each file holds the whole mesh: XML VTK formats
+        # have no reference to geometry in another file.
+        # Each grid has its own writers, created once for all increments.
+        grids = (vtkUnstructuredGrid(), vtkUnstructuredGrid())
+        writers = ({}, {}) # {fmt: writer} for each grid
+        for ugrid, fmt_writers in zip(grids, writers):
+            ugrid.ShallowCopy(self.frd.ugrid)
+            for fmt in fmts:
+                fmt_writers[fmt] = create_writer(fmt, ugrid, self.compressor)
+        # Threads, not processes: vtkUnstructuredGrid can't be pickled.
+        # No more writer threads than cores: at most 4 files are written at once
+        workers = min(2*len(fmts), os.cpu_count() or 1)
+        with concurrent.futures.ThreadPoolExecutor(max(workers, 1)) as executor:
+            writing = [] # futures of the files being written
+
+            def write_increment(i):
+                """Parse results of the increment and write its .vtk/.vtu files."""
+                step, inc, num = self.step_inc_nums[i] # NOTE Could be (0, 0, '')
+                data_arrays = self.increment_data_arrays(step, inc)
+                if not fmts:
+                    return data_arrays
+
+                # Wait for the increment before previous: its grid is reused
+                for future in writing[:-len(fmts)]:
+                    future.result() # reraise exceptions of the writer
+                del writing[:-len(fmts)]
+
+                ugrid = grids[i % 2]
+                pd = ugrid.GetPointData()
+                pd.Initialize() # drop results of the increment before previous, keep the mesh
+                for da in data_arrays:
                     pd.AddArray(da)
-                    pd.Modified()
-
-            for t in threads:
-                t.join() # do not start a new thread while and old one is running
-            threads.clear()
-            for fmt in self.fmt_list: # ['.vtk', '.vtu']
-                file_name = self.frd_file_name[:-4] + num + fmt
-                logging.info('Writing %s', os.path.basename(file_name))
-                t = threading.Thread(target=write_converted_file,
-                    args=(file_name, self.frd.ugrid))
-                t.start()
-                threads.append(t)
-
-        # Write ParaView Data (PVD) for series of VTU files
-        if len(self.frd.steps_increments) > 1 and '.vtu' in self.fmt_list:
-            self.write_pvd()
-
-        in_file.close()
-        for t in threads:
-            t.join() # do not start a new thread while and old one is running
+
+                for fmt in fmts: # ['.vtk', '.vtu']
+                    file_name = stem + num + fmt
+                    logging.info('Writing %s%s%s', base_name, num, fmt)
+                    writing.append(executor.submit(write_file,
+                                                   writers[i % 2][fmt], file_name))
+                return data_arrays
+
+            if '.vtkhdf' in self.fmt_list:
+                # The writer requests increments in turn: each is parsed once for all formats
+                self.write_vtkhdf(write_increment)
+            else:
+                for i in range(len(self.step_inc_nums)):
+                    write_increment(i)
+
+            # Write ParaView Data (PVD) for series of VTU files
+            if len(self.frd.steps_increments) > 1 and '.vtu' in self.fmt_list:
+                self.write_pvd()
+
+            for future in writing:
+                future.result()
+
+    def increment_data_arrays(self, step, inc):
+        """Parse results of the time increment and convert them to VTK arrays."""
+        data_arrays = []
+        for b in self.frd.parse_results(step, inc): # NOTE Could be empty list []
+            b.log()
+            if len(b.results) and len(b.components):
+                data_arrays.append(convert_frd_data_to_vtk(b))
+        return data_arrays
 
     def step_inc_num(self):
         """If model has many time increments - many output files
@@ -948,27 +1309,41 @@ class Converter:
         i = len(self.frd.steps_increments)
         if not i:
             return [(0, 0, '')]
-        d = [] # [(step, inc, num), ]
-        for counter, (step, inc) in enumerate(self.frd.steps_increments):
-            if i > 1:
-                num = f'.{counter+1:0{len(str(i))}}'
-            else:
-                num = ''
-            d.append((step, inc, num)) # without extension
-        return d
+        if i == 1:
+            return [(*self.frd.steps_increments[0], '')]
+        width = len(str(i)) # zero padding
+        return [(step, inc, f'.{counter:0{width}}') # without extension
+                for counter, (step, inc) in enumerate(self.frd.steps_increments, 1)]
+
+    def write_vtkhdf(self, get_data_arrays):
+        """Writes the mesh once and results of all increments to one .vtkhdf file.
+        get_data_arrays: increment index -> [vtkDataArray, ], called in turn.
+        """
+        file_name = self.frd_file_name[:-4] + '.vtkhdf'
+        logging.info('Writing %s', os.path.basename(file_name))
+        times = [inc for _, inc, _ in self.step_inc_nums]
+        if any(t1 <= t0 for t0, t1 in zip(times, times[1:])):
+            logging.info('Time values of increments do not increase: they are numbered instead')
+            times = list(range(1, len(times) + 1))
+        source = IncrementSource(self.frd.ugrid, times, get_data_arrays)
+        writer = vtkHDFWriter()
+        writer.SetInputConnection(source.GetOutputPort())
+        writer.SetWriteAllTimeSteps(len(times) > 1)
+        writer.SetCompressionLevel(0 if self.compressor == 'none' else 1) # deflate only
+        write_file(writer, file_name)
 
     def write_pvd(self):
         """Writes ParaView Data (PVD) file for series of VTU files."""
         logging.info('Writing %s', os.path.basename(self.frd_file_name[:-4] + '.pvd'))
-        with open(self.frd_file_name[:-4] + '.pvd', 'w', encoding = self.encoding) as f:
-            f.write('<?xml version="1.0"?>\n')
-            f.write('<VTKFile type="Collection" version="0.1" byte_order="LittleEndian">\n')
-            f.write('\t<Collection>\n')
-
-            for _, inc, num in self.step_inc_num():
-                file_name = os.path.basename(self.frd_file_name[:-4]) + num
-                file_name = os.path.basename(file_name)
-                f.write(f'\t\t<DataSet file="{file_name}.vtu" timestep="{inc}"/>\n')
-
-            f.write('\t</Collection>\n')
-            f.write('</VTKFile>')
+        # ElementTree escapes file names and serializes the document in C
+        base_name = os.path.basename(self.frd_file_name[:-4])
+        root = ElementTree.Element('VTKFile', type='Collection', version='0.1',
+                                   byte_order='LittleEndian')
+        collection = ElementTree.SubElement(root, 'Collection')
+        for _, inc, num in self.step_inc_nums:
+            ElementTree.SubElement(collection, 'DataSet',
+                                   file=f'{base_name}{num}.vtu', timestep=str(inc))
+        tree = ElementTree.ElementTree(root)
+        ElementTree.indent(tree, space='\t')
+        tree.write(self.frd_file_name[:-4] + '.pvd',
+                   encoding=self.encoding or 'utf-8', xml_declaration=True)
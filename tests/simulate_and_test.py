@@ -17,9 +17,11 @@ Ctrl+F5 to run in VSCode.
 
 # Standard imports
 import os
+import re
 import sys
 import time
 import shutil
+from contextlib import suppress
 import logging
 import subprocess
 
@@ -46,51 +48,60 @@ dir_path_frds = os.path.realpath(os.path.join(dir_path, 'sim_frds'))
 # Number of cores to use for simulation
 N_CORE = int(8)
 
+# Files to clean up, matched by extension with compiled regexes
+SOLVER_FILES = re.compile(r'\.(dat|cvg|sta|out|12d)$')
+SOLVER_AND_RESULT_FILES = re.compile(r'\.(dat|cvg|sta|out|12d|vtk|vtu|vtkhdf|pvd)$')
+# Folders without results: whole subtrees are not scanned
+SKIPPED_FOLDERS = frozenset(('.git', '__pycache__', '.venv', 'node_modules'))
+
 def clean_cache(folder:str=None):
     """Recursively delete cached files in all subfolders."""
     if folder is None:
         folder = os.getcwd()
-    pycache = os.path.join(folder, '__pycache__')
-    if os.path.isdir(pycache):
-        shutil.rmtree(pycache) # works in Linux as in Windows
+    # Top-down walk: removed cache folders and SKIPPED_FOLDERS are pruned
+    for root, dirs, _ in os.walk(folder, onerror=lambda e: \
+            logging.error('Insufficient permissions for %s', e.filename)):
+        if '__pycache__' in dirs:
+            shutil.rmtree(os.path.join(root, '__pycache__')) # works in Linux as in Windows
+        dirs[:] = [d for d in dirs if d not in SKIPPED_FOLDERS]
 
-    # Recursively clear cache in child folders
-    try:
-        for f in os.scandir(folder):
-            if f.is_dir():
-                clean_cache(f.path)
-    except PermissionError:
-        logging.error('Insufficient permissions for %s', dir)
+def remove_files(folder:str, pattern:re.Pattern):
+    """Delete files matching the pattern here and in all subfolders.
+    Iterative walk: a stack of folders instead of recursion.
+    """
+    log_buffer = bytearray() # written at once in the end, encoded once per path
+    stack = [folder]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for f in it:
+                if f.is_dir(follow_symlinks=False):
+                    if f.name not in SKIPPED_FOLDERS:
+                        stack.append(f.path)
+                elif pattern.search(f.name):
+                    with suppress(FileNotFoundError): # already deleted
+                        try:
+                            os.unlink(f.path)
+                            log_buffer += b'Deleted ' + os.fsencode(f.path) + b'\n'
+                        except PermissionError as e:
+                            log_buffer += os.fsencode(f'{f.path}: {e.strerror}\n')
+    if sys.__stdout__ is None: # no console, e.g. pythonw
+        return
+    sys.__stdout__.flush()
+    view = memoryview(log_buffer)
+    while view: # os.write could write only a part of the buffer, e.g. to a pipe
+        view = view[os.write(sys.__stdout__.fileno(), view):]
 
 def clean_results_keep_vtx(folder:str=None):
     """Cleaup old result files keeping the interesting results."""
     if folder is None:
         folder = os.getcwd()
-    extensions = ('.dat', '.cvg', '.sta', '.out', '.12d')
-    for f in os.scandir(folder):
-        if f.is_dir():
-            clean_results(f.path)
-        if f.name.endswith(extensions):
-            try:
-                os.remove(f.path)
-                sys.__stdout__.write('Deleted ' + f.path + '\n')
-            except OSError:
-                sys.__stdout__.write(f.path + ': ' + sys.exc_info()[1][1] + '\n')
+    remove_files(folder, SOLVER_FILES)
 
 def clean_results(folder:str=None):
     """Cleaup old result files."""
     if folder is None:
         folder = os.getcwd()
-    extensions = ('.vtk', '.vtu', '.vtkhdf', '.pvd', '.dat', '.cvg', '.sta', '.out', '.12d')
-    for f in os.scandir(folder):
-        if f.is_dir():
-            clean_results(f.path)
-        if f.name.endswith(extensions):
-            try:
-                os.remove(f.path)
-                sys.__stdout__.write('Deleted ' + f.path + '\n')
-            except OSError:
-                sys.__stdout__.write(f.path + ': ' + sys.exc_info()[1][1] + '\n')
+    remove_files(folder, SOLVER_AND_RESULT_FILES)
 
 def get_time_delta(delta):
     """Return spent time delta in format mm:ss.s."""
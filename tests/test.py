@@ -9,9 +9,9 @@ Ctrl+F5 to run in VSCode.
 """
 
 import os
+import re
 import sys
 import time
-import shutil
 import logging
 import subprocess
 import traceback
@@ -29,42 +29,20 @@ if sys_path not in sys.path:
 from log import LoggingHandler
 from ccx2paraview.cli import clean_screen
 from ccx2paraview.common import Converter
+from simulate_and_test import SKIPPED_FOLDERS, clean_cache, remove_files
 # pylint: enable=wrong-import-position
 
 # Logging Handler
 logging_handler = None # pylint: disable=invalid-name
 
-def clean_cache(folder=None):
-    """Recursively delete cached files in all subfolders."""
-    if folder is None:
-        folder = os.getcwd()
-    pycache = os.path.join(folder, '__pycache__')
-    if os.path.isdir(pycache):
-        shutil.rmtree(pycache) # works in Linux as in Windows
-
-    # Recursively clear cache in child folders
-    try:
-        for f in os.scandir(folder):
-            if f.is_dir():
-                clean_cache(f.path)
-    except PermissionError:
-        logging.error('Insufficient permissions for ' + folder)
-
+# Result files to clean up, matched by extension with compiled regex
+RESULT_FILES = re.compile(r'\.(vtk|vtu|pvd)$')
 
 def clean_results(folder=None):
-    """Cleaup old result files."""
+    """Cleaup old result files here and in all subfolders."""
     if folder is None:
         folder = os.getcwd()
-    extensions = ('.vtk', '.vtu', '.pvd')
-    for f in os.scandir(folder):
-        if f.is_dir():
-            clean_results(f.path)
-        if f.name.endswith(extensions):
-            try:
-                os.remove(f.path)
-                sys.__stdout__.write('Delelted: ' + f.path + '\n')
-            except:
-                sys.__stdout__.write(f.path + ': ' + sys.exc_info()[1][1] + '\n')
+    remove_files(folder, RESULT_FILES)
 
 
 def get_time_delta(delta):
@@ -74,15 +52,19 @@ def get_time_delta(delta):
 
 
 def scan_all_files_in(start_folder, ext, limit=10000):
-    """List all .ext-files here and in all subdirectories."""
+    """List all .ext-files here and in all subdirectories.
+    Iterative walk, files are sorted once in the end.
+    """
     all_files = []
-    for f in os.scandir(start_folder):
-        if f.is_dir():
-            for ff in scan_all_files_in(f.path, ext):
-                all_files.append(ff)
-        elif f.is_file() and f.name.endswith(ext):
-            ff = os.path.normpath(f.path)
-            all_files.append(ff)
+    stack = [start_folder]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for f in it:
+                if f.is_dir():
+                    if f.name not in SKIPPED_FOLDERS:
+                        stack.append(f.path)
+                elif f.is_file() and f.name.endswith(ext):
+                    all_files.append(os.path.normpath(f.path))
     return sorted(all_files)[:limit]
 
 
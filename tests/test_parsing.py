@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+
+"""
+Regression checks of the .frd parser on generated data:
+no CalculiX examples are needed.
+
+Run with pytest or directly: python test_parsing.py
+"""
+
+# Standard imports
+import os
+import sys
+import mmap
+import logging
+import tempfile
+from contextlib import contextmanager
+
+# External imports
+import numpy as np
+
+# make files in ../ccx2paraview available for import
+sys_path = os.path.abspath(__file__)
+sys_path = os.path.dirname(sys_path)
+sys_path = os.path.join(sys_path, '..')
+sys_path = os.path.normpath(sys_path)
+if sys_path not in sys.path:
+    sys.path.insert(0, sys_path)
+
+# local imports
+# pylint: disable=wrong-import-position
+from ccx2paraview.common import FRD, Converter, parse_floats, vtkHDFWriter
+from vtk import vtkHDFReader, vtkXMLUnstructuredGridReader, vtkStreamingDemandDrivenPipeline
+from vtk.util.numpy_support import vtk_to_numpy
+# pylint: enable=wrong-import-position
+
+
+def random_fields(size, seed=0):
+    """Random E12.5 fields with all two-digit exponents, zeros and -0."""
+    rng = np.random.default_rng(seed)
+    values = rng.uniform(-10, 10, size) * 10.0**rng.integers(-99, 99, size)
+    values[::13] = 0.0
+    values[::17] = -0.0
+    values[:4] = 9.99999e99, -1.00000e-99, 1.23456e22, 1.23456e-23 # extreme exponents
+    return np.array([f'{v:12.5E}' for v in values], dtype='S12')
+
+
+def same_bits(a, b):
+    """Arrays are equal bit by bit: -0.0 differs from 0.0."""
+    return a.dtype == b.dtype and a.shape == b.shape \
+        and a.tobytes() == b.tobytes()
+
+
+def test_parse_floats_as_numpy():
+    """Decoded fields are the same as converted by numpy from text."""
+    fields = random_fields(60000).reshape(-1, 6)
+    for dtype in (np.float64, np.float32):
+        with np.errstate(over='ignore'): # too big for Float32: Inf as in numpy
+            values, wrong = parse_floats(fields, dtype)
+            expected = np.array(fields).astype(np.float64).astype(dtype)
+        assert same_bits(values, expected), dtype
+        assert not wrong.any()
+
+
+def test_parse_floats_strided():
+    """Fields sliced from a table of lines: view with strides, not a copy."""
+    fields = random_fields(3000, seed=1).reshape(-1, 3)
+    lines = np.array([b' -1' + b'%10d' % i + b''.join(row) \
+                      for i, row in enumerate(fields)], dtype='S49')
+    table = lines.view(np.uint8).reshape(-1, 49)
+    values, _ = parse_floats(table[:, 13:].view('S12'))
+    assert same_bits(values, np.array(fields).astype(np.float64))
+
+
+def test_parse_floats_text():
+    """Fields, which are not E12.5, are converted from text."""
+    fields = random_fields(600, seed=2).reshape(-1, 6)
+    fields[0, :5] = b'         NaN', b'    Infinity', b'   -Infinity', b'1.5', b' 1.0E+5'
+    fields[1, 0] = b'-1.00000+100' # too big exponent written without 'E'
+    fields[2, 3] = b' 1.00000-100'
+    values, wrong = parse_floats(fields)
+
+    right = np.ones(fields.shape, dtype=bool)
+    right[1, 0] = right[2, 3] = False
+    assert same_bits(values[right], np.array(fields[right]).astype(np.float64))
+    assert values[1, 0] == -1e100 and values[2, 3] == 1e-100
+    assert np.array_equal(wrong, ~right)
+
+
+def as_written(value):
+    """Value rounded as written in E12.5 field."""
+    return float(f'{value:12.5E}')
+
+
+def coords_of(n):
+    """Coordinates of node by its number: check of points order."""
+    return [as_written(v) for v in (n, -2.0*n, 0.5*n)]
+
+
+def results_of(n, ncomps, increment=0):
+    """Result values of node by its number: check of results order."""
+    return [as_written(n + 0.125*c + increment) for c in range(ncomps)]
+
+
+def frd_text(node_numbers, elements, blocks, increments=((1.0, 1),)):
+    """Text of .frd-file with given node numbers in given order.
+    elements: [(type, [node numbers]), ]
+    blocks: [(name, ncomps, node numbers, texts), ] results of each increment,
+    values are given by results_of() or by texts {(node, component): text}.
+    increments: [(time value, step), ]
+    """
+    lines = ['    1C', f'    2C{len(node_numbers):30d}{1:37d}']
+    for n in node_numbers:
+        lines.append(f' -1{n:10d}' + ''.join(f'{v:12.5E}' for v in coords_of(n)))
+    lines += [' -3', f'    3C{len(elements):30d}{1:37d}']
+    for i, (e_type, e_nodes) in enumerate(elements, 1):
+        lines.append(f' -1{i:10d}{e_type:5d}{0:5d}{1:5d}')
+        for j in range(0, len(e_nodes), 10):
+            lines.append(' -2' + ''.join(f'{n:10d}' for n in e_nodes[j:j + 10]))
+    lines.append(' -3')
+    for increment, (value, step) in enumerate(increments):
+        for name, ncomps, nodes, texts in blocks:
+            lines.append(f'  100CL  101{value:12.5E}{len(nodes):12d}{"":20s}{0:2d}{step:5d}')
+            lines.append(f' -4  {name:8s}{ncomps:5d}{1:5d}')
+            lines += [f' -5  {name[0]}{c + 1:<7d}{1:5d}{2:5d}{c + 1:5d}{0:5d}' \
+                      for c in range(ncomps)]
+            for n in nodes:
+                fields = [texts.get((n, c), f'{v:12.5E}') \
+                          for c, v in enumerate(results_of(n, ncomps, increment))]
+                lines.append(f' -1{n:10d}' + ''.join(fields[:6]))
+                for j in range(6, ncomps, 6):
+                    lines.append(' -2' + ' '*10 + ''.join(fields[j:j + 6]))
+            lines.append(' -3')
+    lines.append(' 9999')
+    return '\n'.join(lines) + '\n'
+
+
+def write_frd(folder, text):
+    """Write .frd-file into the folder, return its name."""
+    file_name = os.path.join(folder, 'test.frd')
+    with open(file_name, 'w', encoding='ascii') as f:
+        f.write(text)
+    return file_name
+
+
+@contextmanager
+def logged_messages():
+    """List of messages logged inside the block."""
+    messages = []
+    handler = logging.Handler()
+    handler.emit = lambda record: messages.append(record.getMessage())
+    logging.getLogger().addHandler(handler)
+    try:
+        yield messages
+    finally:
+        logging.getLogger().removeHandler(handler)
+
+
+def parse_frd(text):
+    """Parsed mesh and result blocks of the only increment."""
+    with tempfile.TemporaryDirectory() as folder:
+        file_name = write_frd(folder, text)
+        with open(file_name, 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as in_file:
+            frd = FRD(in_file, derived=())
+            frd.parse_mesh()
+            frd.count_increments()
+            step, inc = frd.steps_increments[0]
+            blocks = frd.parse_results(step, inc)
+            frd.in_file = None
+    return frd, blocks
+
+
+def test_node_numbering():
+    """Points, cells and results follow the order of the node block
+    for dense and sparse, sorted and unsorted node numbers.
+    Results of absent nodes are zeros, results of unknown nodes are skipped.
+    """
+    rng = np.random.default_rng(3)
+    numberings = {
+        'dense sorted': np.arange(1, 41),
+        'dense unsorted': rng.permutation(40) + 1, # lookup table
+        'sparse sorted': np.arange(1, 41) * 100003, # binary search
+        'sparse unsorted': rng.permutation(40) * 100003 + 7,
+        }
+    for numbering, node_numbers in numberings.items():
+        numbers = node_numbers.tolist()
+        elements = [(1, numbers[3:11]), (4, numbers[10:30]), (11, numbers[-2:])]
+        written = rng.permutation(numbers)[:30].tolist() # shuffled, 10 nodes absent
+        blocks = [('DISP', 3, written + [max(numbers) + 5], {}), # unknown node at the end
+                  ('SDV', 8, rng.permutation(numbers).tolist(), {})] # two lines per node
+        frd, results = parse_frd(frd_text(numbers, elements, blocks))
+
+        points = frd.node_block.node_numbers
+        assert np.array_equal(points, node_numbers), numbering
+        assert np.array_equal(frd.node_block.coords, np.float32([coords_of(n) for n in points]))
+
+        cells = frd.elem_block.cells
+        offsets = cells.GetOffsetsArray()
+        connectivity = cells.GetConnectivityArray()
+        for i, (_, e_nodes) in enumerate(elements):
+            start, end = offsets.GetValue(i), offsets.GetValue(i + 1)
+            ids = [connectivity.GetValue(j) for j in range(start, end)]
+            expected = e_nodes if len(e_nodes) != 20 \
+                else e_nodes[:12] + e_nodes[16:] + e_nodes[12:16] # VTK order of 20 node brick
+            assert points[ids].tolist() == expected, numbering
+
+        for b, (name, ncomps, nodes, _) in zip(results, blocks):
+            expected = [results_of(n, ncomps) if n in nodes else [0.0]*ncomps for n in points]
+            assert np.array_equal(b.results, expected), (numbering, name)
+
+
+def test_wrong_format_values():
+    """Too big values written without 'E' are repaired and reported."""
+    numbers = list(range(1, 11))
+    texts = {(3, 1): '-1.00000+100', (7, 0): ' 1.00000-100'}
+    with logged_messages() as messages:
+        frd, results = parse_frd(frd_text(numbers, [(1, numbers[:8])],
+                                          [('DISP', 3, numbers[::-1], texts)]))
+
+    values = results[0].results
+    rows = frd.node_block.renumber(np.array([3, 7]))
+    assert values[rows[0], 1] == -1e100 and values[rows[1], 0] == 1e-100
+    values[rows[0], 1], values[rows[1], 0] = results_of(3, 3)[1], results_of(7, 3)[0]
+    assert np.array_equal(values, [results_of(n, 3) for n in numbers])
+    assert any(m.startswith('Wrong format') and '(2 warnings)' in m for m in messages)
+
+
+def read_grid(reader, file_name):
+    """Points, cells and point data arrays of the grid read from file."""
+    reader.SetFileName(file_name)
+    reader.Update()
+    ugrid = reader.GetOutput()
+    cells = ugrid.GetCells()
+    pd = ugrid.GetPointData()
+    grid = {'points': vtk_to_numpy(ugrid.GetPoints().GetData()),
+            'offsets': vtk_to_numpy(cells.GetOffsetsArray()),
+            'connectivity': vtk_to_numpy(cells.GetConnectivityArray()),
+            'types': np.array([ugrid.GetCellType(i) for i in range(ugrid.GetNumberOfCells())])}
+    for i in range(pd.GetNumberOfArrays()):
+        grid[pd.GetArrayName(i)] = vtk_to_numpy(pd.GetArray(i))
+    return grid
+
+
+def test_vtkhdf_output():
+    """Each increment in .vtkhdf file is the same as in its .vtu file.
+    Time values are kept while they increase, otherwise increments are numbered.
+    Results are parsed and reported once for both formats.
+    """
+    if vtkHDFWriter is None: # VTK < 9.4
+        return
+    numbers = list(range(1, 21))
+    elements = [(1, numbers[:8]), (4, numbers)]
+    blocks = [('DISP', 3, numbers[::-1], {(5, 0): '-1.00000+100'}),
+              ('NDTEMP', 1, numbers[::2], {})]
+    time_steps = (((0.5, 1), (1.0, 1)), [0.5, 1.0]), \
+                 (((1.0, 1), (1.0, 2)), [1.0, 2.0]) # increments of two steps at the same time
+    for increments, times in time_steps:
+        with tempfile.TemporaryDirectory() as folder, logged_messages() as messages:
+            file_name = write_frd(folder, frd_text(numbers, elements, blocks, increments))
+            Converter(file_name, ['vtu', 'vtkhdf']).run()
+
+            reader = vtkHDFReader()
+            reader.SetFileName(file_name[:-4] + '.vtkhdf')
+            reader.UpdateInformation()
+            info = reader.GetOutputInformation(0)
+            assert list(info.Get(vtkStreamingDemandDrivenPipeline.TIME_STEPS())) == times
+            for i, time in enumerate(times, 1):
+                reader.UpdateTimeStep(time)
+                hdf = read_grid(reader, file_name[:-4] + '.vtkhdf')
+                vtu = read_grid(vtkXMLUnstructuredGridReader(), file_name[:-4] + f'.{i}.vtu')
+                assert hdf.keys() == vtu.keys(), increments
+                for key, values in vtu.items():
+                    assert np.array_equal(hdf[key], values), (increments, key)
+        assert sum(m.startswith('Wrong format') for m in messages) == len(times)
+
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_') and callable(test):
+            test()
+            print(name, 'OK')